@@ -0,0 +1,74 @@
+from __future__ import division
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+from menpo.image import MaskedImage
+
+from ._warp_numba import bilinear_sample_into
+
+
+def warp_pixels_to_mask(pixels, mask, transform, landmarks=None,
+                        batch_size=None, points=None):
+    r"""
+    Warps the pixels of an image to the true pixels of a mask.
+
+    This is equivalent to
+    ``image.as_unmasked(copy=False).warp_to_mask(mask, transform,
+    warp_landmarks=True)`` with the default bilinear interpolation, but it
+    works on the pixels array directly, so that no intermediate image is
+    created.
+
+    Parameters
+    ----------
+    pixels : ``(n_channels, height, width)`` `ndarray`
+        The pixels of the image to be warped.
+    mask : :map:`BooleanImage`
+        The mask of the warped image.
+    transform : :map:`Transform`
+        The transform that maps the true pixels of the mask to the image.
+    landmarks : :map:`LandmarkManager`, optional
+        The landmarks of the image. If not ``None``, they are attached to the
+        warped image and mapped to it with the pseudoinverse of the transform.
+    batch_size : `int` or ``None``, optional
+        If an `int`, the true pixels of the mask are transformed in batches
+        of that size, which bounds the memory used by the transform. If
+        ``None``, all of them are transformed at once. It is ignored if
+        ``points`` is given.
+    points : ``(n_true_pixels, 2)`` `ndarray`, optional
+        The precomputed ``transform.apply(mask.true_indices())``, i.e. the
+        points of the image at which the true pixels of the mask are
+        sampled. If ``None``, they are computed from the mask and the
+        transform.
+
+    Returns
+    -------
+    warped_image : :map:`MaskedImage`
+        The warped image.
+    """
+    n_channels = pixels.shape[0]
+    if points is None:
+        points = transform.apply(mask.true_indices(), batch_size=batch_size)
+    sampled = np.empty((n_channels, points.shape[0]))
+    _sample_into(pixels, points, sampled)
+
+    warped_image = MaskedImage.init_blank(mask.shape, n_channels=n_channels,
+                                          mask=mask.copy())
+    warped_image.from_vector_inplace(sampled.ravel())
+    if landmarks is not None:
+        warped_image.landmarks = landmarks
+        transform.pseudoinverse().apply_inplace(warped_image.landmarks)
+    return warped_image
+
+
+def _sample_into(pixels, points, out):
+    r"""
+    Samples each channel of ``pixels`` at ``points`` with bilinear
+    interpolation, using the numba kernel if numba is installed.
+    """
+    if bilinear_sample_into is not None:
+        bilinear_sample_into(pixels, points, out)
+        return
+    for c, channel in enumerate(pixels):
+        out[c] = map_coordinates(channel, points.T, order=1, mode='constant',
+                                 cval=0.)
+    out[np.isnan(out)] = 0
@@ -0,0 +1,61 @@
+from __future__ import division
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+try:
+    from numba import set_num_threads
+except ImportError:
+    set_num_threads = None
+
+
+def _bilinear_sample_into(pixels, coords, out):
+    r"""
+    Samples the channels of an image at a set of points with bilinear
+    interpolation, writing the result into ``out``.
+
+    Points outside the image are set to ``0``, as are ``nan`` samples, which
+    matches ``warp_to_mask`` when ``order=1`` and ``mode='constant'``.
+
+    Parameters
+    ----------
+    pixels : ``(n_channels, height, width)`` `ndarray`
+        The pixels of the image to be sampled.
+    coords : ``(n_points, 2)`` `ndarray`
+        The (y, x) coordinates of the points to be sampled.
+    out : ``(n_channels, n_points)`` `ndarray`
+        The array in which the sampled values are written.
+    """
+    n_channels = pixels.shape[0]
+    max_y = pixels.shape[1] - 1
+    max_x = pixels.shape[2] - 1
+    for i in prange(coords.shape[0]):
+        y = coords[i, 0]
+        x = coords[i, 1]
+        if not (0 <= y <= max_y and 0 <= x <= max_x):
+            for c in range(n_channels):
+                out[c, i] = 0
+            continue
+        y0 = int(y)
+        x0 = int(x)
+        y1 = min(y0 + 1, max_y)
+        x1 = min(x0 + 1, max_x)
+        dy = y - y0
+        dx = x - x0
+        for c in range(n_channels):
+            value = ((1 - dy) * ((1 - dx) * pixels[c, y0, x0] +
+                                 dx * pixels[c, y0, x1]) +
+                     dy * ((1 - dx) * pixels[c, y1, x0] +
+                           dx * pixels[c, y1, x1]))
+            if value != value:
+                value = 0
+            out[c, i] = value
+
+
+if njit is not None:
+    bilinear_sample_into = njit(cache=True, parallel=True)(
+        _bilinear_sample_into)
+else:
+    bilinear_sample_into = None
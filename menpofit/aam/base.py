@@ -1,10 +1,130 @@
 from __future__ import division
+import hashlib
+import multiprocessing
+import os
+import tempfile
 
 import numpy as np
-from menpo.shape import TriMesh
+from menpo.image import MaskedImage
+from menpo.shape import PointCloud, TriMesh
 
 from menpofit.base import DeformableModel, name_of_callable
 from .builder import build_patch_reference_frame, build_reference_frame
+from ._warp import warp_pixels_to_mask
+from ._warp_numba import set_num_threads
+
+
+_viz_cache = {}
+
+
+def _get_viz(name):
+    r"""
+    Returns the ``visualize_<name>`` widget of :mod:`menpofit.visualize`.
+
+    The widgets depend on IPython, so they are only imported the first time
+    one of them is requested and then kept in ``_viz_cache``.
+    """
+    if name not in _viz_cache:
+        from menpofit.visualize import (visualize_shape_model,
+                                        visualize_appearance_model,
+                                        visualize_aam)
+        _viz_cache.update(shape_model=visualize_shape_model,
+                          appearance_model=visualize_appearance_model,
+                          aam=visualize_aam)
+    return _viz_cache[name]
+
+
+def _sqrt_eigs(model, cache, key):
+    r"""
+    Returns the square root of the eigenvalues of the active components of
+    a :map:`PCAModel`, stored in ``cache`` under ``key``.
+
+    The stored square roots are recomputed whenever the eigenvalues of the
+    model are replaced (e.g. by ``PCAModel.increment``) or its number of active
+    components changes.
+    """
+    eigenvalues = model._eigenvalues
+    n_active_components = model.n_active_components
+    cached = cache.get(key)
+    if (cached is None or cached[0] is not eigenvalues or
+            cached[1] != n_active_components):
+        cached = (eigenvalues, n_active_components,
+                  np.sqrt(model.eigenvalues))
+        cache[key] = cached
+    return cached[2]
+
+
+def _scaled_instance(model, weights, sqrt_eigs):
+    r"""
+    Returns the instance of a :map:`PCAModel` for the given weights, which are
+    expressed in units of standard deviation, i.e. are scaled by
+    ``sqrt_eigs``. If ``weights`` is ``None``, the mean instance is returned.
+    """
+    # TODO: this bit of logic should to be transferred down to PCAModel
+    if weights is None:
+        weights = [0]
+    # scale the weights into a new array so that the user's input is never
+    # modified in place
+    weights = np.asarray(weights, dtype=np.float64)
+    return model.instance(weights * sqrt_eigs[:weights.size])
+
+
+def _save_reference_frame(path, reference_frame):
+    r"""
+    Stores the mask and the ``'source'`` landmarks of a reference frame to an
+    ``.npz`` file.
+    """
+    landmarks = reference_frame.landmarks['source'].lms
+    arrays = {'mask': reference_frame.mask.mask, 'points': landmarks.points}
+    if isinstance(landmarks, TriMesh):
+        arrays['trilist'] = landmarks.trilist
+    # the file is written next to its final location and then renamed, so
+    # that concurrent readers never see a partially written reference frame
+    fd, tmp_path = tempfile.mkstemp(suffix='.npz',
+                                    dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # on Windows an existing file cannot be replaced by os.rename
+            os.remove(path)
+            os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _load_reference_frame(path):
+    r"""
+    Rebuilds a reference frame stored by :func:`_save_reference_frame`.
+    """
+    with np.load(path) as arrays:
+        reference_frame = MaskedImage.init_blank(arrays['mask'].shape,
+                                                 mask=arrays['mask'])
+        if 'trilist' in arrays:
+            landmarks = TriMesh(arrays['points'], trilist=arrays['trilist'])
+        else:
+            landmarks = PointCloud(arrays['points'])
+    reference_frame.landmarks['source'] = landmarks
+    return reference_frame
+
+
+def _random_instances_chunk(aam, n_instances, level, seed, n_threads=None):
+    r"""
+    Generates a chunk of random AAM instances with its own random generator.
+    Used as a job of :meth:`AAM.random_instances_parallel`.
+
+    If ``n_threads`` is not ``None``, the numba warp kernel of the worker is
+    limited to that many threads, so that the workers do not oversubscribe
+    the CPUs.
+    """
+    if n_threads is not None and set_num_threads is not None:
+        set_num_threads(n_threads)
+    random_state = np.random.RandomState(seed)
+    return list(aam._random_instances(n_instances, level, random_state))
 
 
 class AAM(DeformableModel):
@@ -71,6 +191,49 @@ class AAM(DeformableModel):
         self.reference_shape = reference_shape
         self.downscale = downscale
         self.scaled_shape_models = scaled_shape_models
+        self._init_caches()
+
+    def _init_caches(self):
+        self._refframe_cache = {}
+        self._refframe_cache_path = None
+        self._refframe_cache_regenerate = False
+        # square roots of the eigenvalues of the shape and appearance models of
+        # each level, used to scale the weights of every instance
+        self._sqrt_eigs_cache = {}
+        # (n_channels, n_true_pixels, shape string, n_features) of the
+        # template of each level, as reported by __str__
+        self._level_info = [(am.template_instance.n_channels,
+                             am.template_instance.n_true_pixels(),
+                             am.template_instance._str_shape, am.n_features)
+                            for am in self.appearance_models]
+        # the landmarks and triangulation of the template of each level are
+        # fixed, so they are looked up once and baked into the instance
+        # function of the level
+        self._trilists_per_level = []
+        self._instance_fns = []
+        for level, am in enumerate(self.appearance_models):
+            landmarks = am.mean().landmarks['source'].lms
+            if isinstance(landmarks, TriMesh):
+                self._trilists_per_level.append(landmarks.trilist)
+            else:
+                self._trilists_per_level.append(None)
+            self._instance_fns.append(self._make_instance_fn(level,
+                                                             landmarks))
+
+    def __getstate__(self):
+        # cached data are rebuilt on demand and the disk cache is a setting of
+        # the current session, so none of them is pickled along with the model
+        state = self.__dict__.copy()
+        for attr in ('_sqrt_eigs_cache', '_level_info',
+                     '_trilists_per_level',
+                     '_instance_fns', '_refframe_cache',
+                     '_refframe_cache_path', '_refframe_cache_regenerate'):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
 
     @property
     def n_levels(self):
@@ -109,21 +272,68 @@ class AAM(DeformableModel):
         """
         sm = self.shape_models[level]
         am = self.appearance_models[level]
+        sm_sqrt_eigs, am_sqrt_eigs = self._sqrt_eigenvalues(level)
 
-        # TODO: this bit of logic should to be transferred down to PCAModel
-        if shape_weights is None:
-            shape_weights = [0]
-        if appearance_weights is None:
-            appearance_weights = [0]
-        n_shape_weights = len(shape_weights)
-        shape_weights *= sm.eigenvalues[:n_shape_weights] ** 0.5
-        shape_instance = sm.instance(shape_weights)
-        n_appearance_weights = len(appearance_weights)
-        appearance_weights *= am.eigenvalues[:n_appearance_weights] ** 0.5
-        appearance_instance = am.instance(appearance_weights)
+        shape_instance = _scaled_instance(sm, shape_weights, sm_sqrt_eigs)
+        appearance_instance = _scaled_instance(am, appearance_weights,
+                                               am_sqrt_eigs)
 
         return self._instance(level, shape_instance, appearance_instance)
 
+    def instances(self, shape_weights, appearance_weights, level=-1,
+                  batch_size=None):
+        r"""
+        Generates a list of novel AAM instances given lists of shape and
+        appearance weights.
+
+        The warp of each shape instance is only solved once, so consecutive
+        instances that share the same shape weights (e.g. when only the
+        appearance varies) are generated by sampling their appearances at the
+        same warped points.
+
+        Parameters
+        -----------
+        shape_weights : `list` of ``(n_weights,)`` `ndarray`
+            The weights of the shape model of each instance. An element equal
+            to ``None`` corresponds to the mean shape.
+
+        appearance_weights : `list` of ``(n_weights,)`` `ndarray`
+            The weights of the appearance model of each instance. An element
+            equal to ``None`` corresponds to the mean appearance.
+
+        level : `int`, optional
+            The pyramidal level to be used.
+
+        batch_size : `int` or ``None``, optional
+            If an `int`, the points of the reference frame are transformed in
+            batches of that size, which bounds the memory used when the warp
+            of a new shape is solved. If ``None``, all points are transformed
+            at once.
+
+        Returns
+        -------
+        images : `list` of :map:`Image`
+            The novel AAM instances.
+
+        Raises
+        ------
+        ValueError
+            shape_weights and appearance_weights must have the same length
+        """
+        if len(shape_weights) != len(appearance_weights):
+            raise ValueError("shape_weights and appearance_weights must have "
+                             "the same length")
+        sm = self.shape_models[level]
+        am = self.appearance_models[level]
+        sm_sqrt_eigs, am_sqrt_eigs = self._sqrt_eigenvalues(level)
+        instance_fn = self._instance_fns[level]
+
+        return [instance_fn(_scaled_instance(sm, s_weights, sm_sqrt_eigs),
+                            _scaled_instance(am, a_weights, am_sqrt_eigs),
+                            batch_size=batch_size)
+                for s_weights, a_weights in zip(shape_weights,
+                                                appearance_weights)]
+
     def random_instance(self, level=-1):
         r"""
         Generates a novel random instance of the AAM.
@@ -138,39 +348,204 @@ class AAM(DeformableModel):
         image : :map:`Image`
             The novel AAM instance.
         """
+        return next(self.random_instances(1, level=level))
+
+    def random_instances(self, n_instances, level=-1):
+        r"""
+        Generates novel random instances of the AAM.
+
+        The random weights of all the instances are drawn at once, which makes
+        this method preferable to repeated calls of :meth:`random_instance`
+        when many instances are required (e.g. for data augmentation).
+
+        Parameters
+        -----------
+        n_instances : `int`
+            The number of instances to be generated.
+
+        level : `int`, optional
+            The pyramidal level to be used.
+
+        Returns
+        -------
+        images : `generator` of :map:`Image`
+            A generator yielding the novel AAM instances.
+        """
+        return self._random_instances(n_instances, level, np.random)
+
+    def random_instances_parallel(self, n_instances, level=-1, n_jobs=-1,
+                                  batch=None, seed=None):
+        r"""
+        Generates novel random instances of the AAM using multiple processes.
+
+        The instances are generated in chunks of ``batch`` instances, each of
+        which is a single job. The whole AAM, including the components of all
+        its appearance models, is pickled and sent to a worker for every job,
+        so by default each worker is given a single chunk.
+
+        Parameters
+        -----------
+        n_instances : `int`
+            The number of instances to be generated.
+
+        level : `int`, optional
+            The pyramidal level to be used.
+
+        n_jobs : `int`, optional
+            The number of processes to use. If ``-1``, all CPUs are used.
+
+        batch : `int` or ``None``, optional
+            The number of instances generated by each job. If ``None``, it is
+            ``ceil(n_instances / n_jobs)``, so that there is one job per
+            process.
+
+        seed : `int` or ``None``, optional
+            The seed of the random generator of the first job; job ``i`` is
+            seeded with ``seed + i``, so the result only depends on the
+            ``seed`` and the ``batch`` (and therefore on ``n_jobs`` if
+            ``batch`` is ``None``). If ``None``, the seed is drawn from
+            NumPy's global random state.
+
+        Returns
+        -------
+        images : `list` of :map:`Image`
+            The novel AAM instances.
+        """
+        from sklearn.externals.joblib import Parallel, delayed
+        n_cpus = multiprocessing.cpu_count()
+        n_workers = n_jobs if n_jobs > 0 else max(n_cpus + 1 + n_jobs, 1)
+        if batch is None:
+            batch = max(int(np.ceil(n_instances / n_workers)), 1)
+        # a single worker runs the jobs in this process, whose numba threads
+        # are left untouched
+        n_threads = max(n_cpus // n_workers, 1) if n_workers > 1 else None
+        if seed is None:
+            seed = np.random.randint(np.iinfo(np.int32).max - n_instances)
+        chunks = [min(batch, n_instances - start)
+                  for start in range(0, n_instances, batch)]
+        images = Parallel(n_jobs=n_jobs)(
+            delayed(_random_instances_chunk)(self, n, level, seed + i,
+                                             n_threads=n_threads)
+            for i, n in enumerate(chunks))
+        return [image for chunk in images for image in chunk]
+
+    def _random_instances(self, n_instances, level, random_state):
         sm = self.shape_models[level]
         am = self.appearance_models[level]
+        n_shape = sm.n_active_components
 
         # TODO: this bit of logic should to be transferred down to PCAModel
-        shape_weights = (np.random.randn(sm.n_active_components) *
-                         sm.eigenvalues[:sm.n_active_components]**0.5)
-        shape_instance = sm.instance(shape_weights)
-        appearance_weights = (np.random.randn(am.n_active_components) *
-                              am.eigenvalues[:am.n_active_components]**0.5)
-        appearance_instance = am.instance(appearance_weights)
-
-        return self._instance(level, shape_instance, appearance_instance)
+        weights = random_state.randn(n_instances,
+                                     n_shape + am.n_active_components)
+        sm_sqrt_eigs, am_sqrt_eigs = self._sqrt_eigenvalues(level)
+        weights[:, :n_shape] *= sm_sqrt_eigs
+        weights[:, n_shape:] *= am_sqrt_eigs
+        for w in weights:
+            shape_instance = sm.instance(w[:n_shape])
+            appearance_instance = am.instance(w[n_shape:])
+            yield self._instance(level, shape_instance, appearance_instance)
+
+    def _sqrt_eigenvalues(self, level):
+        level = level % self.n_levels
+        return (_sqrt_eigs(self.shape_models[level], self._sqrt_eigs_cache,
+                           ('shape', level)),
+                _sqrt_eigs(self.appearance_models[level],
+                           self._sqrt_eigs_cache, ('appearance', level)))
 
     def _instance(self, level, shape_instance, appearance_instance):
-        template = self.appearance_models[level].mean()
-        landmarks = template.landmarks['source'].lms
+        return self._instance_fns[level](shape_instance, appearance_instance)
+
+    def _make_instance_fn(self, level, landmarks):
+        # everything that is fixed for the level is bound once, so that
+        # generating an instance does not go through the attributes of the AAM.
+        # The transform is a setting that can be reassigned, so it is read on
+        # every call instead and is part of the key of the cached warp.
+        refframe_cache = self._refframe_cache
+        load_or_build_reference_frame = self._load_or_build_reference_frame
+
+        def instance_fn(shape_instance, appearance_instance, batch_size=None):
+            # the reference frame and the transform only depend on the shape
+            # instance, so the ones of the last instance generated at this
+            # level are kept and reused while the shape does not change
+            transform_cls = self.transform
+            key = (transform_cls, shape_instance.points.tobytes())
+            cached = refframe_cache.get(level)
+            if cached is not None and cached[0] == key:
+                reference_frame, transform, points = cached[1:]
+            else:
+                reference_frame = load_or_build_reference_frame(
+                    shape_instance, level)
+                transform = transform_cls(
+                    reference_frame.landmarks['source'].lms, landmarks)
+                # the points at which the appearances are sampled are solved
+                # once, so that every warp with this shape only re-samples
+                points = transform.apply(reference_frame.mask.true_indices(),
+                                         batch_size=batch_size)
+                refframe_cache[level] = (key, reference_frame, transform,
+                                         points)
+
+            if appearance_instance.has_landmarks:
+                appearance_landmarks = appearance_instance.landmarks
+            else:
+                appearance_landmarks = None
+            return warp_pixels_to_mask(
+                appearance_instance.pixels, reference_frame.mask, transform,
+                landmarks=appearance_landmarks, points=points)
 
-        reference_frame = self._build_reference_frame(
-            shape_instance, landmarks)
+        return instance_fn
 
-        transform = self.transform(
-            reference_frame.landmarks['source'].lms, landmarks)
+    def set_reference_frame_cache(self, path, cache_regenerate=False):
+        r"""
+        Sets a directory in which the reference frames built while generating
+        instances are stored, so that later calls, and later sessions using
+        the same model, load them instead of building them again.
 
-        return appearance_instance.as_unmasked(copy=False).warp_to_mask(
-            reference_frame.mask, transform, warp_landmarks=True)
+        Only the reference frames of the mean shape of each level are stored,
+        as they are the ones that are built repeatedly (e.g. for every
+        instance with the default shape weights). The size of the cache is
+        therefore bounded by the number of levels of the model.
 
-    def _build_reference_frame(self, reference_shape, landmarks):
-        if type(landmarks) == TriMesh:
-            trilist = landmarks.trilist
-        else:
-            trilist = None
+        Parameters
+        -----------
+        path : `str` or ``None``
+            The directory of the cache. It is created if it does not exist.
+            If ``None``, reference frames are not stored on disk.
+
+        cache_regenerate : `boolean`, optional
+            If ``True``, the reference frames stored in the cache are ignored
+            and overwritten by newly built ones.
+        """
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        self._refframe_cache_path = path
+        self._refframe_cache_regenerate = cache_regenerate
+
+    def _load_or_build_reference_frame(self, reference_shape, level):
+        if (self._refframe_cache_path is None or
+                not np.array_equal(reference_shape.points,
+                                   self.shape_models[level].mean().points)):
+            return self._build_reference_frame(reference_shape, level)
+
+        key = self._reference_frame_key(reference_shape, level)
+        path = os.path.join(self._refframe_cache_path,
+                            key.hexdigest() + '.npz')
+        if os.path.exists(path) and not self._refframe_cache_regenerate:
+            return _load_reference_frame(path)
+
+        reference_frame = self._build_reference_frame(reference_shape, level)
+        _save_reference_frame(path, reference_frame)
+        return reference_frame
+
+    def _reference_frame_key(self, reference_shape, level):
+        key = hashlib.sha1(reference_shape.points.tobytes())
+        trilist = self._trilists_per_level[level]
+        if trilist is not None:
+            key.update(trilist.tobytes())
+        return key
+
+    def _build_reference_frame(self, reference_shape, level):
         return build_reference_frame(
-            reference_shape, trilist=trilist)
+            reference_shape, trilist=self._trilists_per_level[level])
 
     @property
     def _str_title(self):
@@ -209,8 +584,7 @@ class AAM(DeformableModel):
             If ``'coloured'``, then the style of the widget will be coloured. If
             ``minimal``, then the style is simple using black and white colours.
         """
-        from menpofit.visualize import visualize_shape_model
-        visualize_shape_model(
+        _get_viz('shape_model')(
             self.shape_models, n_parameters=n_parameters,
             parameters_bounds=parameters_bounds, figure_size=figure_size,
             mode=mode, style=style)
@@ -243,8 +617,7 @@ class AAM(DeformableModel):
             If ``'coloured'``, then the style of the widget will be coloured. If
             ``minimal``, then the style is simple using black and white colours.
         """
-        from menpofit.visualize import visualize_appearance_model
-        visualize_appearance_model(
+        _get_viz('appearance_model')(
             self.appearance_models, n_parameters=n_parameters,
             parameters_bounds=parameters_bounds, figure_size=figure_size,
             mode=mode, style=style)
@@ -284,21 +657,23 @@ class AAM(DeformableModel):
             If ``'coloured'``, then the style of the widget will be coloured. If
             ``minimal``, then the style is simple using black and white colours.
         """
-        from menpofit.visualize import visualize_aam
-        visualize_aam(self, n_shape_parameters=n_shape_parameters,
-                      n_appearance_parameters=n_appearance_parameters,
-                      parameters_bounds=parameters_bounds,
-                      figure_size=figure_size, mode=mode, style=style)
+        _get_viz('aam')(self, n_shape_parameters=n_shape_parameters,
+                        n_appearance_parameters=n_appearance_parameters,
+                        parameters_bounds=parameters_bounds,
+                        figure_size=figure_size, mode=mode, style=style)
 
     def __str__(self):
-        out = "{}\n - {} training images.\n".format(self._str_title,
-                                                    self.n_training_images)
+        lines = [self._str_title,
+                 " - {} training images.".format(self.n_training_images)]
+        sms = self.shape_models
+        ams = self.appearance_models
+        # percentages of variance retained by the models of each level
+        shape_var = [sm.variance_ratio() * 100 for sm in sms]
+        app_var = [am.variance_ratio() * 100 for am in ams]
         # small strings about number of channels, channels string and downscale
-        n_channels = []
+        n_channels = [info[0] for info in self._level_info]
         down_str = []
         for j in range(self.n_levels):
-            n_channels.append(
-                self.appearance_models[j].template_instance.n_channels)
             if j == self.n_levels - 1:
                 down_str.append('(no downscale)')
             else:
@@ -322,75 +697,72 @@ class AAM(DeformableModel):
                     ch_str.append("channel")
                 else:
                     ch_str.append("channels")
-        out = "{} - {} Warp.\n".format(out, name_of_callable(self.transform))
+        lines.append(" - {} Warp.".format(name_of_callable(self.transform)))
         if self.n_levels > 1:
             if self.scaled_shape_models:
-                out = "{} - Gaussian pyramid with {} levels and downscale " \
-                      "factor of {}.\n   - Each level has a scaled shape " \
-                      "model (reference frame).\n".format(out, self.n_levels,
-                                                          self.downscale)
-
+                lines.append(" - Gaussian pyramid with {} levels and "
+                             "downscale factor of {}.".format(
+                                 self.n_levels, self.downscale))
+                lines.append("   - Each level has a scaled shape model "
+                             "(reference frame).")
             else:
-                out = "{} - Gaussian pyramid with {} levels and downscale " \
-                      "factor of {}:\n   - Shape models (reference frames) " \
-                      "are not scaled.\n".format(out, self.n_levels,
-                                                 self.downscale)
+                lines.append(" - Gaussian pyramid with {} levels and "
+                             "downscale factor of {}:".format(
+                                 self.n_levels, self.downscale))
+                lines.append("   - Shape models (reference frames) are not "
+                             "scaled.")
             if self.pyramid_on_features:
-                out = "{}   - Pyramid was applied on feature space.\n   " \
-                      "{}{} {} per image.\n".format(out, feat_str,
-                                                    n_channels[0], ch_str[0])
+                lines.append("   - Pyramid was applied on feature space.")
+                lines.append("   {}{} {} per image.".format(
+                    feat_str, n_channels[0], ch_str[0]))
                 if not self.scaled_shape_models:
-                    out = "{}   - Reference frames of length {} " \
-                          "({} x {}C, {} x {}C)\n".format(
-                        out,
-                        self.appearance_models[0].n_features,
-                        self.appearance_models[0].template_instance.n_true_pixels(),
-                        n_channels[0],
-                        self.appearance_models[0].template_instance._str_shape,
-                        n_channels[0])
+                    n_ch, n_pixels, shape_str, n_features = self._level_info[0]
+                    lines.append(
+                        "   - Reference frames of length {} "
+                        "({} x {}C, {} x {}C)".format(
+                            n_features, n_pixels, n_ch, shape_str, n_ch))
             else:
-                out = "{}   - Features were extracted at each pyramid " \
-                      "level.\n".format(out)
+                lines.append("   - Features were extracted at each pyramid "
+                             "level.")
             for i in range(self.n_levels - 1, -1, -1):
-                out = "{}   - Level {} {}: \n".format(out, self.n_levels - i,
-                                                      down_str[i])
+                n_ch, n_pixels, shape_str, n_features = self._level_info[i]
+                lines.append("   - Level {} {}: ".format(self.n_levels - i,
+                                                         down_str[i]))
                 if not self.pyramid_on_features:
-                    out = "{}     {}{} {} per image.\n".format(
-                        out, feat_str[i], n_channels[i], ch_str[i])
+                    lines.append("     {}{} {} per image.".format(
+                        feat_str[i], n_ch, ch_str[i]))
                 if (self.scaled_shape_models or
                         (not self.pyramid_on_features)):
-                    out = "{}     - Reference frame of length {} " \
-                          "({} x {}C, {} x {}C)\n".format(
-                        out, self.appearance_models[i].n_features,
-                        self.appearance_models[i].template_instance.n_true_pixels(),
-                        n_channels[i],
-                        self.appearance_models[i].template_instance._str_shape,
-                        n_channels[i])
-                out = "{0}     - {1} shape components ({2:.2f}% of " \
-                      "variance)\n     - {3} appearance components " \
-                      "({4:.2f}% of variance)\n".format(
-                    out, self.shape_models[i].n_components,
-                    self.shape_models[i].variance_ratio() * 100,
-                    self.appearance_models[i].n_components,
-                    self.appearance_models[i].variance_ratio() * 100)
+                    lines.append(
+                        "     - Reference frame of length {} "
+                        "({} x {}C, {} x {}C)".format(
+                            n_features, n_pixels, n_ch, shape_str, n_ch))
+                lines.append("     - {0} shape components ({1:.2f}% of "
+                             "variance)".format(sms[i].n_components,
+                                                shape_var[i]))
+                lines.append("     - {0} appearance components ({1:.2f}% of "
+                             "variance)".format(ams[i].n_components,
+                                                app_var[i]))
         else:
             if self.pyramid_on_features:
                 feat_str = [feat_str]
-            out = "{0} - No pyramid used:\n   {1}{2} {3} per image.\n" \
-                  "   - Reference frame of length {4} ({5} x {6}C, " \
-                  "{7} x {8}C)\n   - {9} shape components ({10:.2f}% of " \
-                  "variance)\n   - {11} appearance components ({12:.2f}% of " \
-                  "variance)\n".format(
-                out, feat_str[0], n_channels[0], ch_str[0],
-                self.appearance_models[0].n_features,
-                self.appearance_models[0].template_instance.n_true_pixels(),
-                n_channels[0],
-                self.appearance_models[0].template_instance._str_shape,
-                n_channels[0], self.shape_models[0].n_components,
-                self.shape_models[0].variance_ratio() * 100,
-                self.appearance_models[0].n_components,
-                self.appearance_models[0].variance_ratio() * 100)
-        return out
+            lines.append(" - No pyramid used:")
+            lines.append("   {}{} {} per image.".format(
+                feat_str[0], n_channels[0], ch_str[0]))
+            n_ch, n_pixels, shape_str, n_features = self._level_info[0]
+            lines.append(
+                "   - Reference frame of length {} ({} x {}C, "
+                "{} x {}C)".format(n_features, n_pixels, n_ch, shape_str,
+                                   n_ch))
+            lines.append("   - {0} shape components ({1:.2f}% of "
+                         "variance)".format(sms[0].n_components,
+                                            shape_var[0]))
+            lines.append("   - {0} appearance components ({1:.2f}% of "
+                         "variance)".format(ams[0].n_components,
+                                            app_var[0]))
+        # the empty last line keeps the trailing newline of the description
+        lines.append('')
+        return '\n'.join(lines)
 
 
 class PatchBasedAAM(AAM):
@@ -457,10 +829,15 @@ class PatchBasedAAM(AAM):
             features, reference_shape, downscale, scaled_shape_models)
         self.patch_shape = patch_shape
 
-    def _build_reference_frame(self, reference_shape, landmarks):
+    def _build_reference_frame(self, reference_shape, level):
         return build_patch_reference_frame(
             reference_shape, patch_shape=self.patch_shape)
 
+    def _reference_frame_key(self, reference_shape, level):
+        key = hashlib.sha1(reference_shape.points.tobytes())
+        key.update(np.asarray(self.patch_shape, dtype=np.int64).tobytes())
+        return key
+
     @property
     def _str_title(self):
         r"""
@@ -2,7 +2,10 @@ try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
+import os
 import platform
+import shutil
+import tempfile
 
 from mock import patch
 import numpy as np
@@ -14,6 +17,7 @@ from menpo.feature import sparse_hog, igo, lbp, no_op
 import menpo.io as mio
 from menpo.landmark import ibug_face_68_trimesh
 from menpofit.aam import AAMBuilder, PatchBasedAAMBuilder
+from menpofit.aam.base import _sqrt_eigs
 
 
 # load images
@@ -197,3 +201,166 @@ def test_aam_4():
         # https://github.com/menpo/menpo/issues/450
         assert_allclose([aam4.appearance_models[j].components.shape[1]
                          for j in range(aam4.n_levels)], (23656, 25988))
+
+
+def test_instance_does_not_modify_weights():
+    shape_weights = np.array([1, -1])
+    appearance_weights = np.array([0.5, 0.5, -0.5])
+    aam1.instance(shape_weights=shape_weights,
+                  appearance_weights=appearance_weights)
+    assert_allclose(shape_weights, [1, -1])
+    assert_allclose(appearance_weights, [0.5, 0.5, -0.5])
+
+
+def test_sqrt_eigs_cache():
+    sm = aam2.shape_models[0]
+    n_active_components = sm.n_active_components
+    cache = {}
+    sqrt_eigs = _sqrt_eigs(sm, cache, 'shape')
+    assert_allclose(sqrt_eigs, np.sqrt(sm.eigenvalues))
+    assert _sqrt_eigs(sm, cache, 'shape') is sqrt_eigs
+    sm.n_active_components = 1
+    try:
+        assert _sqrt_eigs(sm, cache, 'shape').size == 1
+    finally:
+        sm.n_active_components = n_active_components
+    assert _sqrt_eigs(sm, cache, 'shape').size == n_active_components
+
+
+def test_instance_reuses_reference_frame():
+    aam = aam2
+    instance_1 = aam.instance(appearance_weights=[1.0])
+    _, reference_frame, transform, points = \
+        aam._refframe_cache[aam.n_levels - 1]
+    assert_allclose(points,
+                    transform.apply(reference_frame.mask.true_indices()))
+    instance_2 = aam.instance(appearance_weights=[-1.0])
+    assert aam._refframe_cache[aam.n_levels - 1][1] is reference_frame
+    assert aam._refframe_cache[aam.n_levels - 1][2] is transform
+    assert aam._refframe_cache[aam.n_levels - 1][3] is points
+    assert_allclose(instance_1.mask.pixels, instance_2.mask.pixels)
+    assert instance_1.mask is not instance_2.mask
+    assert instance_1.mask is not reference_frame.mask
+    aam.instance(shape_weights=[1.0])
+    assert aam._refframe_cache[aam.n_levels - 1][1] is not reference_frame
+
+
+def test_instance_uses_reassigned_transform():
+    transform = aam1.transform
+    aam1.instance()
+    aam1.transform = ThinPlateSplines
+    try:
+        aam1.instance()
+        assert isinstance(aam1._refframe_cache[aam1.n_levels - 1][2],
+                          ThinPlateSplines)
+    finally:
+        aam1.transform = transform
+
+
+def test_instances():
+    shape_weights = [[1.0], [1.0], None]
+    appearance_weights = [[1.0, 0.5], [-1.0, 0.5], None]
+    images = aam1.instances(shape_weights, appearance_weights)
+    assert len(images) == 3
+    for s, a, image in zip(shape_weights, appearance_weights, images):
+        expected = aam1.instance(shape_weights=s, appearance_weights=a)
+        assert_allclose(image.pixels, expected.pixels)
+
+
+@raises(ValueError)
+def test_instances_length_exception():
+    aam1.instances([None, None], [None])
+
+
+def test_random_instances():
+    np.random.seed(0)
+    images = list(aam1.random_instances(2))
+    assert len(images) == 2
+    np.random.seed(0)
+    for image in images:
+        assert_allclose(image.pixels, aam1.random_instance().pixels)
+
+
+def test_reference_frame_disk_cache():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        aam1.set_reference_frame_cache(cache_dir)
+        aam1._refframe_cache.clear()
+        instance_1 = aam1.instance()
+        assert len(os.listdir(cache_dir)) == 1
+        aam1._refframe_cache.clear()
+        instance_2 = aam1.instance()
+        assert len(os.listdir(cache_dir)) == 1
+        assert_allclose(instance_1.mask.pixels, instance_2.mask.pixels)
+        assert_allclose(instance_1.pixels, instance_2.pixels)
+        aam1.instance(shape_weights=[0.5])
+        assert len(os.listdir(cache_dir)) == 1
+    finally:
+        aam1.set_reference_frame_cache(None)
+        shutil.rmtree(cache_dir)
+
+
+def test_random_instances_parallel():
+    images_1 = aam2.random_instances_parallel(5, n_jobs=1, batch=2, seed=1)
+    images_2 = aam2.random_instances_parallel(5, n_jobs=2, batch=2, seed=1)
+    assert len(images_1) == 5
+    for image_1, image_2 in zip(images_1, images_2):
+        assert_allclose(image_1.pixels, image_2.pixels)
+    images_3 = aam2.random_instances_parallel(5, n_jobs=2, seed=1)
+    images_4 = aam2.random_instances_parallel(5, n_jobs=1, batch=3, seed=1)
+    assert len(images_3) == 5
+    for image_3, image_4 in zip(images_3, images_4):
+        assert_allclose(image_3.pixels, image_4.pixels)
+
+
+def test_trilists_per_level():
+    assert len(aam1._trilists_per_level) == aam1.n_levels
+    for level_trilist in aam1._trilists_per_level:
+        assert_allclose(level_trilist, trilist)
+    assert all(t is None for t in aam2._trilists_per_level)
+
+
+def test_instance_jit_warp():
+    shape_weights = [0.5, -0.5]
+    appearance_weights = [1.0]
+    instance = aam1.instance(shape_weights=shape_weights,
+                             appearance_weights=appearance_weights)
+    aam1._refframe_cache.clear()
+    with patch('menpofit.aam._warp.bilinear_sample_into', None):
+        expected = aam1.instance(shape_weights=shape_weights,
+                                 appearance_weights=appearance_weights)
+    assert_allclose(instance.mask.pixels, expected.mask.pixels)
+    assert_allclose(instance.pixels, expected.pixels)
+    assert_allclose(instance.landmarks['source'].lms.points,
+                    expected.landmarks['source'].lms.points)
+
+
+def test_sqrt_eigenvalues_per_level():
+    sm = aam2.shape_models[-1]
+    n_active_components = sm.n_active_components
+    sm_sqrt_eigs, am_sqrt_eigs = aam2._sqrt_eigenvalues(-1)
+    assert_allclose(sm_sqrt_eigs, np.sqrt(sm.eigenvalues))
+    assert_allclose(am_sqrt_eigs,
+                    np.sqrt(aam2.appearance_models[-1].eigenvalues))
+    assert aam2._sqrt_eigenvalues(-1)[0] is sm_sqrt_eigs
+    sm.n_active_components = n_active_components - 1
+    try:
+        assert (aam2._sqrt_eigenvalues(-1)[0].size ==
+                n_active_components - 1)
+        aam2.instance(shape_weights=[1.0])
+    finally:
+        sm.n_active_components = n_active_components
+    assert aam2._sqrt_eigenvalues(-1)[0].size == n_active_components
+
+
+def test_sqrt_eigenvalues_replaced_eigenvalues():
+    sm = aam2.shape_models[-1]
+    eigenvalues = sm._eigenvalues
+    aam2._sqrt_eigenvalues(-1)
+    sm._eigenvalues = eigenvalues * 4
+    try:
+        assert_allclose(aam2._sqrt_eigenvalues(-1)[0],
+                        2 * np.sqrt(sm.eigenvalues / 4))
+    finally:
+        sm._eigenvalues = eigenvalues
+
@@ -0,0 +1,53 @@
+import numpy as np
+from numpy.testing import assert_allclose
+from nose.plugins.skip import SkipTest
+from scipy.ndimage import map_coordinates
+from menpo.image import Image, BooleanImage
+from menpo.shape import PointCloud
+from menpo.transform import Affine
+
+from menpofit.aam._warp import warp_pixels_to_mask
+from menpofit.aam._warp_numba import bilinear_sample_into
+
+
+def test_bilinear_sample_into():
+    if bilinear_sample_into is None:
+        raise SkipTest('numba is not installed')
+    pixels = np.random.rand(3, 40, 50)
+    points = np.vstack([np.random.uniform(-2, 41, 1000),
+                        np.random.uniform(-2, 51, 1000)]).T
+    points[:4] = [[0, 0], [39, 49], [39, 0], [0, 49]]
+    sampled = np.empty((3, points.shape[0]))
+    bilinear_sample_into(pixels, points, sampled)
+    expected = np.array([map_coordinates(p, points.T, order=1,
+                                         mode='constant', cval=0.)
+                         for p in pixels])
+    assert_allclose(sampled, expected)
+
+
+def test_warp_pixels_to_mask():
+    image = Image(np.random.rand(2, 40, 50))
+    image.landmarks['source'] = PointCloud(np.random.uniform(0, 30, (5, 2)))
+    mask = BooleanImage.init_blank((20, 25))
+    mask.pixels[0, :3, :4] = False
+    transform = Affine(np.array([[1.2, 0.1, 3.], [-0.1, 0.9, 5.], [0, 0, 1]]))
+    expected = image.warp_to_mask(mask, transform, warp_landmarks=True)
+    for batch_size in [None, 7]:
+        warped = warp_pixels_to_mask(image.pixels, mask, transform,
+                                     landmarks=image.landmarks,
+                                     batch_size=batch_size)
+        assert_allclose(warped.mask.pixels, expected.mask.pixels)
+        assert_allclose(warped.pixels, expected.pixels)
+        assert_allclose(warped.landmarks['source'].lms.points,
+                        expected.landmarks['source'].lms.points)
+
+
+def test_warp_pixels_to_mask_points():
+    pixels = np.random.rand(2, 40, 50)
+    mask = BooleanImage.init_blank((20, 25))
+    mask.pixels[0, :3, :4] = False
+    transform = Affine(np.array([[1.2, 0.1, 3.], [-0.1, 0.9, 5.], [0, 0, 1]]))
+    points = transform.apply(mask.true_indices())
+    warped = warp_pixels_to_mask(pixels, mask, transform, points=points)
+    expected = warp_pixels_to_mask(pixels, mask, transform)
+    assert_allclose(warped.pixels, expected.pixels)